@@ -1,67 +1,308 @@
 """
 Autoanosis AI Backend v3
-Professional Flask backend for AI Assistant with Medical Context
-Deployed on Render.com
+Professional async Quart backend for AI Assistant with Medical Context
+Deployed on Render.com (Hypercorn ASGI server)
 """
 
 import os
+import asyncio
+import functools
+import hashlib
 import logging
 import time
-import uuid
-from collections import defaultdict
-from datetime import datetime
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from openai import OpenAI
+from itertools import islice
+import orjson
+from cachetools import TTLCache
+from quart import Quart, Response, request
+from quart.json.provider import JSONProvider
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from identity import verify_identity_token
+from cache import ResponseCache, SemanticCache, make_cache_key
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson for request parsing"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def json_response(obj, status: int = 200) -> Response:
+    """Serialize obj with orjson straight into a JSON response"""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+# Initialize Quart app
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+
+# Reject oversized bodies before they are read into memory
+MAX_REQUEST_BYTES = 32 * 1024
+MAX_MESSAGE_LENGTH = 4000  # characters
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
 
 # Configure CORS - allow requests from autoanosis.com
-CORS(app, resources={
-    r"/*": {
-        "origins": [
-            "https://autoanosis.com",
-            "https://www.autoanosis.com"
-        ],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "X-User-ID"],
-        "supports_credentials": True
-    }
+# The origin list is fixed, so preflight headers are built once at import
+# and OPTIONS requests are answered before any route dispatch
+CORS_ALLOWED_ORIGINS = frozenset({
+    "https://autoanosis.com",
+    "https://www.autoanosis.com"
 })
+CORS_PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, X-User-ID",
+    "Access-Control-Allow-Credentials": "true",
+    "Access-Control-Max-Age": "600",
+    "Vary": "Origin"
+}
+
+@app.before_request
+async def cors_preflight():
+    if request.method == "OPTIONS":
+        origin = request.headers.get("Origin")
+        if origin in CORS_ALLOWED_ORIGINS:
+            return Response(b"", 204, headers={**CORS_PREFLIGHT_HEADERS,
+                                               "Access-Control-Allow-Origin": origin})
+
+@app.after_request
+async def add_cors_headers(response):
+    origin = request.headers.get("Origin")
+    if origin in CORS_ALLOWED_ORIGINS and "Access-Control-Allow-Origin" not in response.headers:
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+    response.vary.add("Origin")
+    return response
+
+# Configure async OpenAI client (lazy initialization, shared by all requests)
+# One pooled HTTP/2 connection set to api.openai.com amortizes TLS handshakes
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 50
+OPENAI_TIMEOUT = 30.0
+OPENAI_CONNECT_TIMEOUT = 3.0
+
+# Transient OpenAI failures are retried here (SDK retries are disabled so
+# attempts are not multiplied). Timeouts are only retried when the request
+# never reached OpenAI, so a slow generation is not billed more than once.
+# A non-streamed completion's read timeout spans the whole generation, so it
+# gets OPENAI_COMPLETION_TIMEOUT; streams and embeddings only wait
+# OPENAI_REQUEST_TIMEOUT for the next bytes
+OPENAI_MAX_ATTEMPTS = 3
+OPENAI_REQUEST_TIMEOUT = 15.0
+OPENAI_COMPLETION_TIMEOUT = 120.0
+
+# Cap in-flight OpenAI calls per worker so bursts queue locally instead of
+# tripping the per-minute request limit upstream
+OPENAI_MAX_CONCURRENCY = 50
+openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
 
-# Configure OpenAI client (lazy initialization)
 openai_client = None
 
 def get_openai_client():
     global openai_client
     if openai_client is None:
-        openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        # Imported on first use: the SDK pulls in pydantic/httpx/anyio, which
+        # would otherwise slow every worker boot
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        openai_client = AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+            )
+        )
     return openai_client
 
-# Token Bridge Configuration
-TOKEN_SECRET = os.environ.get("AUTOANOSIS_IDENTITY_SECRET", "CHANGE_THIS_SECRET")
+@app.after_serving
+async def close_openai_client():
+    """Close the pooled OpenAI HTTP connections on shutdown"""
+    global openai_client
+    if openai_client is not None:
+        await openai_client.close()
+        openai_client = None
+
+def is_transient_openai_error(exc: BaseException) -> bool:
+    """True for rate limits, connection errors and pre-send timeouts worth retrying"""
+    # openai and httpx are always imported by the time one of their errors is raised
+    import httpx
+    from openai import APIConnectionError, APITimeoutError, RateLimitError
+    if isinstance(exc, APITimeoutError):
+        # Waiting for a connection or pool slot means nothing was sent; a read
+        # timeout may mean OpenAI is still generating (and billing) the reply
+        return isinstance(exc.__cause__, (httpx.ConnectTimeout, httpx.PoolTimeout))
+    return isinstance(exc, (RateLimitError, APIConnectionError))
+
+# Each attempt takes its own openai_slots permit, so backoff sleeps between
+# attempts never hold one
+openai_retry = retry(
+    stop=stop_after_attempt(OPENAI_MAX_ATTEMPTS),
+    wait=wait_exponential_jitter(initial=0.5, max=4),
+    retry=retry_if_exception(is_transient_openai_error),
+    reraise=True
+)
+
+@openai_retry
+async def create_chat_completion(messages: list, **kwargs):
+    """Create a (non-streamed) chat completion, retrying transient errors"""
+    import httpx
+    client = get_openai_client()
+    async with openai_slots:
+        return await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=CHAT_TEMPERATURE,
+            timeout=httpx.Timeout(OPENAI_COMPLETION_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            **kwargs
+        )
+
+@openai_retry
+async def open_chat_stream(messages: list, **kwargs):
+    """
+    Start a streamed chat completion, retrying transient errors
+
+    The returned stream holds an openai_slots permit; the caller must
+    release it once the stream is consumed or abandoned.
+    """
+    import httpx
+    client = get_openai_client()
+    await openai_slots.acquire()
+    try:
+        return await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=CHAT_TEMPERATURE,
+            stream=True,
+            timeout=httpx.Timeout(OPENAI_REQUEST_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            **kwargs
+        )
+    except BaseException:
+        openai_slots.release()
+        raise
+
+# In-process state below is shared by every request on a worker's event loop.
+# Tasks only switch at an await, so each read-modify-write of these stores
+# (token bucket refill/consume, conversation append/trim and single-flight
+# lookups) is written without an await between the read
+# and the write and needs no lock. Keep it that way when editing them;
+# anything handed to a thread works on a copy (see SemanticCache.snapshot).
 
-# Rate limiting storage (in-memory)
-rate_limit_storage = defaultdict(list)
+# Rate limiting storage (in-memory token buckets)
+# Format: {identifier: (tokens, last_refill_timestamp)}
+rate_limit_storage = {}
 RATE_LIMIT_USER = 20  # 20 requests per 10 minutes for authenticated users
 RATE_LIMIT_WINDOW = 600  # 10 minutes in seconds
+RATE_LIMIT_CAPACITY = float(RATE_LIMIT_USER)  # burst size
+RATE_LIMIT_REFILL_RATE = RATE_LIMIT_USER / RATE_LIMIT_WINDOW  # tokens per second
+RATE_LIMIT_SWEEP_THRESHOLD = 1000  # sweep idle buckets once this many are tracked
+RATE_LIMIT_SWEEP_INTERVAL = 60  # ...but at most once a minute
+last_rate_limit_sweep = 0.0
+
+# Same token bucket as a Redis script, so refill + consume is one atomic
+# round trip shared by every worker. Idle buckets expire once they would
+# have refilled to capacity, so Redis needs no sweep.
+# KEYS[1] = bucket key; ARGV = capacity, refill rate, now, ttl, cost
+RATE_LIMIT_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+local cost = tonumber(ARGV[5])
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return allowed
+"""
 
-# Session Memory Storage (in-memory)
-# Format: {conversation_id: {"messages": [...], "last_activity": timestamp, "user_id": int}}
-conversation_storage = {}
+# Session Memory Storage (in-memory, bounded; Redis lists when configured)
+# Format: {"<user_id>:<conversation_id>": {"messages": [...], "last_activity": timestamp, "user_id": int}}
+# Keys are scoped to the authenticated user, so a guessed or leaked
+# conversation_id never exposes another user's (medical) history
+# TTLCache expires idle conversations and evicts the least recently used
+# one once MAX_CONVERSATIONS is reached, both in O(1) per write
 MAX_CONVERSATION_HISTORY = 10  # Keep last 10 messages per conversation
+MAX_CONVERSATIONS = 10_000
 CONVERSATION_TTL = 3600  # 1 hour
+conversation_storage = TTLCache(maxsize=MAX_CONVERSATIONS, ttl=CONVERSATION_TTL)
+
+# OpenAI completion settings
+CHAT_MODEL = "gpt-4"
+CHAT_TEMPERATURE = 0.7
+
+# Shared Redis (optional) so caches, rate limits and conversations survive
+# restarts and span workers
+REDIS_URL = os.environ.get("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "64"))
+# Short socket timeouts so a stalled Redis raises (and callers fall back to
+# in-process state) instead of hanging the request; redis-py waits forever by default
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", "0.5"))
+redis_client = None
+rate_limit_script = None
+if REDIS_URL:
+    import redis.asyncio as redis
+    redis_client = redis.Redis.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        decode_responses=False
+    )
+    # Runs via EVALSHA, re-sending the script only if Redis has not seen it
+    rate_limit_script = redis_client.register_script(RATE_LIMIT_SCRIPT)
+
+@app.after_serving
+async def close_redis_client():
+    if redis_client is not None:
+        await redis_client.aclose()
+
+# OpenAI Batch API for non-interactive questions (50% cheaper, 24h window)
+# The submitting user_id is stored in the batch metadata, so any worker can
+# check ownership without shared state. Every prompt costs one rate-limit
+# token, so a batch can never exceed the bucket's capacity. The request body
+# is still capped at MAX_REQUEST_BYTES, so long prompts fit fewer per batch
+BATCH_MAX_PROMPTS = RATE_LIMIT_USER
+BATCH_COMPLETION_WINDOW = "24h"
+# Statuses after which OpenAI no longer touches a batch's files
+BATCH_FINAL_STATUSES = ("completed", "expired", "cancelled", "failed")
+
+# Exact-match response cache (first-turn questions only)
+RESPONSE_CACHE_SIZE = 10_000
+RESPONSE_CACHE_TTL = 3600  # 1 hour
+response_cache = ResponseCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, redis=redis_client)
+
+# Finished batch results, kept after their OpenAI files are deleted so
+# repeated polls (on any worker) still see them for a day
+BATCH_RESULTS_CACHE_SIZE = 1_000
+BATCH_RESULTS_TTL = 24 * 3600
+batch_results_cache = ResponseCache(maxsize=BATCH_RESULTS_CACHE_SIZE, ttl=BATCH_RESULTS_TTL,
+                                    redis=redis_client, prefix=b"batch:")
+
+# Single-flight: {cache_key: asyncio.Task} for replies currently being generated
+inflight_replies = {}
 
 # System prompt for Autoanosis health assistant
+# Kept byte-identical across requests (and above OpenAI's 1024-token prompt
+# caching threshold) so the prefix is served from the provider's prompt cache.
+# Never interpolate per-user data here; medical context goes in its own message.
 SYSTEM_PROMPT_BASE = """Είσαι ο Autoanosis Assistant, ένας εξειδικευμένος βοηθός υγείας στα ελληνικά.
 
 Παρέχεις:
@@ -72,59 +313,324 @@ SYSTEM_PROMPT_BASE = """Είσαι ο Autoanosis Assistant, ένας εξειδ
 Σημαντικό:
 - ΔΕΝ αντικαθιστάς ιατρική συμβουλή
 - Συνιστάς πάντα επίσκεψη σε γιατρό για σοβαρά θέματα
-- Απαντάς στα ελληνικά"""
+- Απαντάς στα ελληνικά
+
+Τρόπος απάντησης:
+- Ξεκινάς με μια σύντομη, άμεση απάντηση στην ερώτηση και μετά δίνεις λεπτομέρειες
+- Χρησιμοποιείς απλή γλώσσα· όταν αναφέρεις ιατρικό όρο, τον εξηγείς με λίγες λέξεις
+- Οργανώνεις τις μεγαλύτερες απαντήσεις σε σύντομες παραγράφους ή λίστες
+- Δεν επινοείς στατιστικά, μελέτες ή πηγές· αν δεν είσαι βέβαιος, το λες ξεκάθαρα
+- Δεν θέτεις διάγνωση· περιγράφεις πιθανές αιτίες και πότε χρειάζεται εξέταση από γιατρό
+- Κάνεις διευκρινιστικές ερωτήσεις όταν λείπουν κρίσιμα στοιχεία (ηλικία, διάρκεια συμπτωμάτων, φάρμακα)
+
+Κανόνες επείγοντος (triage):
+- Αν ο χρήστης περιγράφει πόνο στο στήθος, δύσπνοια, λιποθυμία, ξαφνική αδυναμία ή μούδιασμα στη μία πλευρά του σώματος, δυσκολία στην ομιλία, σοβαρή αιμορραγία, σπασμούς ή απώλεια συνείδησης, τον καλείς να επικοινωνήσει αμέσως με το ΕΚΑΒ στο 166 ή με το 112
+- Για υψηλό πυρετό με δυσκαμψία αυχένα, πολύ έντονο αιφνίδιο πονοκέφαλο ή σύγχυση, συνιστάς άμεση ιατρική εκτίμηση
+- Για πιθανή δηλητηρίαση ή υπερδοσολογία φαρμάκου, παραπέμπεις στο Κέντρο Δηλητηριάσεων (210 7793777) και στο 166
+- Αν ο χρήστης εκφράζει σκέψεις αυτοτραυματισμού ή αυτοκτονίας, απαντάς με ενσυναίσθηση και προτείνεις τη Γραμμή Παρέμβασης για την Αυτοκτονία 1018 ή το 112
+- Σε επείγουσες περιπτώσεις δίνεις πρώτα την οδηγία για βοήθεια και μετά οποιαδήποτε άλλη πληροφορία
+
+Φάρμακα:
+- Δεν συστήνεις έναρξη, διακοπή ή αλλαγή δόσης συνταγογραφούμενου φαρμάκου· αυτό το αποφασίζει ο θεράπων γιατρός
+- Δίνεις γενικές πληροφορίες για ενδείξεις, συνήθεις ανεπιθύμητες ενέργειες και αλληλεπιδράσεις, με την υπενθύμιση να διαβάσει το φύλλο οδηγιών
+- Για αλληλεπιδράσεις μεταξύ φαρμάκων, συμπληρωμάτων, βοτάνων ή αλκοόλ συνιστάς επιβεβαίωση με φαρμακοποιό ή γιατρό
+- Για αντιβιοτικά τονίζεις ότι λαμβάνονται μόνο με ιατρική συνταγή και για όλη τη διάρκεια της θεραπείας
+- Για μη συνταγογραφούμενα παυσίπονα αναφέρεις τη μέγιστη ημερήσια δόση του φύλλου οδηγιών και τις αντενδείξεις (π.χ. στομάχι, νεφρά, αντιπηκτικά)
+
+Ειδικές ομάδες:
+- Εγκυμοσύνη και θηλασμός: κάθε φάρμακο ή συμπλήρωμα πρέπει να εγκρίνεται από τον γιατρό
+- Βρέφη και παιδιά: οι δόσεις εξαρτώνται από το βάρος και η εκτίμηση γίνεται από παιδίατρο
+- Ηλικιωμένοι και άτομα με χρόνια νοσήματα: επισημαίνεις τον αυξημένο κίνδυνο επιπλοκών και αλληλεπιδράσεων
+
+Προσωπικά δεδομένα:
+- Αν σου δοθούν προσωπικά ιατρικά δεδομένα του χρήστη σε ξεχωριστό μήνυμα, τα χρησιμοποιείς μόνο για να προσαρμόσεις την απάντηση
+- Δεν επαναλαμβάνεις αυτούσια τα δεδομένα χωρίς λόγο και δεν βγάζεις συμπεράσματα πέρα από όσα αναφέρονται
+- Αν τα δεδομένα έρχονται σε αντίθεση με όσα γράφει ο χρήστης, ζητάς διευκρίνιση
+
+Κλείσιμο:
+- Όταν το θέμα είναι σοβαρό ή τα συμπτώματα επιμένουν, κλείνεις με σύσταση για επίσκεψη σε γιατρό
+- Παραμένεις ευγενικός, ήρεμος και χωρίς να προκαλείς πανικό"""
 
-def check_rate_limit(identifier: str) -> bool:
-    """Check if identifier has exceeded rate limit"""
-    current_time = time.time()
+# Built once and shared by every request (the OpenAI SDK never mutates it)
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT_BASE}
+
+# Semantic cache for paraphrased questions. Off by default: the user message
+# itself often carries personal details (age, pregnancy, current medication),
+# and a reply written for it would be served to anyone whose question is
+# merely similar, e.g. an answer for "I'm 8 months pregnant, can I take
+# ibuprofen?" reaching someone who asked "can I take ibuprofen?". Only the
+# medical snapshot is excluded from matching; nothing inspects the message,
+# so enable it only where questions are known to be generic (e.g. a fixed FAQ).
+# Unlike exact-match keys, persisted entries carry no TTL, so the file is
+# tagged with the settings that produced the answers and discarded on load
+# once any of them changes
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_SIZE = 5_000
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "").lower() in ("1", "true")
+SEMANTIC_CACHE_FINGERPRINT = hashlib.sha256(
+    orjson.dumps([EMBEDDING_MODEL, CHAT_MODEL, CHAT_TEMPERATURE, SYSTEM_PROMPT_BASE])
+).hexdigest()
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    maxsize=SEMANTIC_CACHE_SIZE,
+    path=os.environ.get("SEMANTIC_CACHE_PATH") if SEMANTIC_CACHE_ENABLED else None,
+    fingerprint=SEMANTIC_CACHE_FINGERPRINT
+)
+semantic_cache_persist_lock = asyncio.Lock()
+# Background persist started by cache_response (referenced so it is not
+# garbage collected mid-write)
+semantic_cache_persist_task = None
+
+def check_local_rate_limit(identifier: str, current_time: float = None, cost: int = 1) -> bool:
+    """Check if identifier has exceeded rate limit (O(1) in-memory token bucket)"""
+    if current_time is None:
+        current_time = time.time()
+    tokens, last_refill = rate_limit_storage.get(identifier, (RATE_LIMIT_CAPACITY, current_time))
     
-    # Clean old entries
-    rate_limit_storage[identifier] = [
-        t for t in rate_limit_storage[identifier] 
-        if current_time - t < RATE_LIMIT_WINDOW
-    ]
+    # Refill for the time elapsed since the last check
+    tokens = min(RATE_LIMIT_CAPACITY, tokens + (current_time - last_refill) * RATE_LIMIT_REFILL_RATE)
     
-    # Check limit
-    if len(rate_limit_storage[identifier]) >= RATE_LIMIT_USER:
+    # Check limit (nothing is consumed when the full cost is not available)
+    if tokens < cost:
+        rate_limit_storage[identifier] = (tokens, current_time)
         return False
     
-    # Record this request
-    rate_limit_storage[identifier].append(current_time)
+    # Consume this request's tokens
+    rate_limit_storage[identifier] = (tokens - cost, current_time)
     return True
 
-def cleanup_old_conversations():
-    """Remove expired conversations"""
-    current_time = time.time()
-    expired = [
-        conv_id for conv_id, data in conversation_storage.items()
-        if current_time - data.get('last_activity', 0) > CONVERSATION_TTL
+def cleanup_rate_limits(current_time: float = None):
+    """Remove buckets that have refilled to capacity (indistinguishable from new)"""
+    global last_rate_limit_sweep
+    if current_time is None:
+        current_time = time.time()
+    last_rate_limit_sweep = current_time
+    idle = [
+        identifier for identifier, (tokens, last_refill) in rate_limit_storage.items()
+        if tokens + (current_time - last_refill) * RATE_LIMIT_REFILL_RATE >= RATE_LIMIT_CAPACITY
     ]
-    for conv_id in expired:
-        del conversation_storage[conv_id]
-        logger.info(f"Cleaned up expired conversation: {conv_id}")
+    for identifier in idle:
+        del rate_limit_storage[identifier]
 
-def get_conversation_history(conversation_id: str) -> list:
-    """Get conversation history for context"""
-    if conversation_id not in conversation_storage:
+async def check_rate_limit(identifier: str, current_time: float = None, cost: int = 1) -> bool:
+    """
+    Check the rate limit in Redis when configured, in this worker otherwise
+
+    cost is the number of tokens the request needs (one per OpenAI completion).
+    """
+    if current_time is None:
+        current_time = time.time()
+    if rate_limit_script is not None:
+        try:
+            allowed = await rate_limit_script(
+                keys=[f"ratelimit:{identifier}"],
+                args=[RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL_RATE, current_time, RATE_LIMIT_WINDOW,
+                      cost]
+            )
+            return bool(allowed)
+        except Exception as e:
+            logger.warning("Redis rate limit failed, using local bucket: %s", e)
+    return check_local_rate_limit(identifier, current_time, cost)
+
+def conversation_key(user_id: int, conversation_id: str) -> str:
+    """Storage key for a conversation, owned by the user who started it"""
+    return f"{user_id}:{conversation_id}"
+
+def get_local_conversation_history(conversation_id: str, user_id: int) -> list:
+    """Get conversation history for context from this worker's memory"""
+    conv = conversation_storage.get(conversation_key(user_id, conversation_id))
+    if conv is None:
         return []
-    return conversation_storage[conversation_id].get('messages', [])
-
-def save_conversation_message(conversation_id: str, user_id: int, role: str, content: str):
-    """Save message to conversation history"""
-    if conversation_id not in conversation_storage:
-        conversation_storage[conversation_id] = {
-            'messages': [],
-            'user_id': user_id,
-            'last_activity': time.time()
-        }
+    return conv.get('messages', [])
+
+def save_local_conversation_turn(conversation_id: str, user_id: int, user_message: str,
+                                 ai_response: str, now: float = None):
+    """Append a user/assistant exchange to this worker's conversation history"""
+    key = conversation_key(user_id, conversation_id)
+    conv = conversation_storage.get(key)
+    if conv is None:
+        conv = {'messages': [], 'user_id': user_id}
     
-    conv = conversation_storage[conversation_id]
-    conv['messages'].append({'role': role, 'content': content})
-    conv['last_activity'] = time.time()
+    messages = conv['messages']
+    messages.append({'role': 'user', 'content': user_message})
+    messages.append({'role': 'assistant', 'content': ai_response})
+    conv['last_activity'] = time.time() if now is None else now
     
-    # Keep only last N messages
-    if len(conv['messages']) > MAX_CONVERSATION_HISTORY:
-        conv['messages'] = conv['messages'][-MAX_CONVERSATION_HISTORY:]
+    # Keep only last N messages, trimming the stored list in place
+    del messages[:-MAX_CONVERSATION_HISTORY]
+    
+    # (Re-)insert to restart the conversation's TTL
+    conversation_storage[key] = conv
+
+async def get_conversation_history(conversation_id: str, user_id: int) -> list:
+    """Get user_id's conversation history for context (Redis when configured)"""
+    if redis_client is not None:
+        try:
+            raw = await redis_client.lrange(f"conv:{conversation_key(user_id, conversation_id)}", 0, -1)
+            return [orjson.loads(message) for message in raw]
+        except Exception as e:
+            logger.warning("Redis conversation read failed: %s", e)
+    return get_local_conversation_history(conversation_id, user_id)
+
+async def save_conversation_turn(conversation_id: str, user_id: int, user_message: str,
+                                 ai_response: str, now: float = None):
+    """Append a user/assistant exchange to conversation history (Redis when configured)"""
+    if redis_client is not None:
+        key = f"conv:{conversation_key(user_id, conversation_id)}"
+        try:
+            # Append, trim to the last N messages and restart the TTL atomically
+            async with redis_client.pipeline(transaction=True) as pipe:
+                await (
+                    pipe.rpush(key,
+                               orjson.dumps({'role': 'user', 'content': user_message}),
+                               orjson.dumps({'role': 'assistant', 'content': ai_response}))
+                    .ltrim(key, -MAX_CONVERSATION_HISTORY, -1)
+                    .expire(key, CONVERSATION_TTL)
+                    .execute()
+                )
+            return
+        except Exception as e:
+            logger.warning("Redis conversation write failed: %s", e)
+    save_local_conversation_turn(conversation_id, user_id, user_message, ai_response, now)
+
+async def embed_message(message: str):
+    """Embed a user message for semantic cache lookups, None on failure"""
+    try:
+        client = get_openai_client()
+        async with openai_slots:
+            result = await client.embeddings.create(model=EMBEDDING_MODEL, input=message,
+                                                    timeout=OPENAI_REQUEST_TIMEOUT)
+        return result.data[0].embedding
+    except Exception as e:
+        logger.warning("Embedding Error: %s", e)
+        return None
+
+async def persist_semantic_cache():
+    """Write the semantic cache to disk without blocking the event loop"""
+    try:
+        # Orders this worker's own saves so its newest snapshot lands last;
+        # other workers write separate temp files (see SemanticCache.save)
+        async with semantic_cache_persist_lock:
+            await asyncio.to_thread(semantic_cache.save, semantic_cache.snapshot())
+    except Exception as e:
+        logger.warning("Semantic cache persist failed: %s", e)
+
+@app.after_serving
+async def save_semantic_cache():
+    if semantic_cache.path:
+        await persist_semantic_cache()
+
+async def cache_response(cache_key, query_embedding, ai_response: str):
+    """Store a freshly generated first-turn response in the caches"""
+    global semantic_cache_persist_task
+    if cache_key is None or not ai_response:
+        return
+    await response_cache.set(cache_key, ai_response)
+    if query_embedding is not None:
+        semantic_cache.add(query_embedding, ai_response)
+        # Persist in the background so the pickle never delays this reply;
+        # one pending write at a time is enough, it snapshots the latest state
+        if semantic_cache.should_persist and (
+                semantic_cache_persist_task is None or semantic_cache_persist_task.done()):
+            semantic_cache_persist_task = asyncio.create_task(persist_semantic_cache())
+
+async def generate_reply(messages: list, cache_key, query_embedding, user_id: int) -> str:
+    """Call OpenAI for a reply and cache it if the question is cacheable"""
+    response = await create_chat_completion(messages)
+    ai_response = response.choices[0].message.content
+    log_prompt_cache_usage(response.usage, user_id)
+    await cache_response(cache_key, query_embedding, ai_response)
+    return ai_response
+
+def finish_inflight_reply(cache_key: str, task: asyncio.Task):
+    """Forget a finished single-flight task and mark its error as retrieved"""
+    inflight_replies.pop(cache_key, None)
+    if not task.cancelled():
+        task.exception()
+
+async def complete_chat(messages: list, cache_key, query_embedding, user_id: int) -> str:
+    """
+    Generate a reply, collapsing concurrent identical cache misses
+
+    Requests with the same cache key that arrive while a reply is being
+    generated await that one upstream call instead of issuing their own.
+    The call runs as a shielded task, so it still completes and fills the
+    cache if the request that started it disconnects.
+    """
+    if cache_key is None:
+        return await generate_reply(messages, cache_key, query_embedding, user_id)
+
+    task = inflight_replies.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(generate_reply(messages, cache_key, query_embedding, user_id))
+        inflight_replies[cache_key] = task
+        task.add_done_callback(functools.partial(finish_inflight_reply, cache_key))
+    else:
+        logger.info("Joined in-flight reply for user %s", user_id)
+    return await asyncio.shield(task)
+
+def log_prompt_cache_usage(usage, user_id: int):
+    """Log how many prompt tokens were served from OpenAI's prompt cache"""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    logger.info("OpenAI usage for user %s: prompt_tokens=%s, cached_tokens=%s, completion_tokens=%s",
+                user_id, usage.prompt_tokens, cached_tokens, usage.completion_tokens)
+
+def sse_event(payload: dict) -> bytes:
+    """Format a payload as a Server-Sent Events data frame"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+async def stream_chat(messages: list, ai_response, cache_key, query_embedding,
+                      conversation_id: str, user_id: int, user_message: str):
+    """Yield the AI reply as SSE deltas, then save the finished turn"""
+    if ai_response is not None:
+        yield sse_event({"delta": ai_response})
+    else:
+        try:
+            parts = []
+            stream = await open_chat_stream(messages, stream_options={"include_usage": True})
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        # Final chunk carries usage only
+                        log_prompt_cache_usage(chunk.usage, user_id)
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+            finally:
+                openai_slots.release()
+                await stream.close()
+            ai_response = "".join(parts)
+            await cache_response(cache_key, query_embedding, ai_response)
+        except Exception as e:
+            logger.error("OpenAI Error: %s", e)
+            yield sse_event({"error": str(e)})
+            return
+
+    # Save to conversation history
+    await save_conversation_turn(conversation_id, user_id, user_message, ai_response)
+
+    logger.info("Chat interaction (streamed): User=%s, Conversation=%s", user_id, conversation_id)
+
+    yield sse_event({"done": True, "conversation_id": conversation_id})
+
+# Snapshot sections rendered into the medical context, in order:
+# (snapshot field, item key, label, separator, max items or None for all)
+MEDICAL_CONTEXT_FIELDS = (
+    ("autoanosis_medications", "name", "Φάρμακα που παίρνει", ", ", None),
+    ("autoanosis_conditions", "name", "Παθήσεις", ", ", None),
+    ("autoanosis_allergies", "name", "Αλλεργίες", ", ", None),
+    ("autoanosis_medical_memory", "note", "Πρόσφατες σημειώσεις", "; ", 3),  # Last 3 entries
+)
+
+# Fixed text around the rendered sections, built once at import
+MEDICAL_CONTEXT_HEADER = "📋 ΠΡΟΣΩΠΙΚΑ ΙΑΤΡΙΚΑ ΔΕΔΟΜΕΝΑ ΧΡΗΣΤΗ:\n"
+MEDICAL_CONTEXT_FOOTER = "\n\nΧρησιμοποίησε αυτά τα στοιχεία για να δώσεις προσωποποιημένες απαντήσεις."
 
 def build_medical_context(medical_snapshot: dict) -> str:
     """Build medical context string from snapshot"""
@@ -132,139 +638,317 @@ def build_medical_context(medical_snapshot: dict) -> str:
         return ""
     
     context_parts = []
-    
-    # Medications
-    meds = medical_snapshot.get('autoanosis_medications')
-    if meds and isinstance(meds, list) and len(meds) > 0:
-        med_names = [m.get('name', '') for m in meds if isinstance(m, dict) and m.get('name')]
-        if med_names:
-            context_parts.append(f"Φάρμακα που παίρνει: {', '.join(med_names)}")
-    
-    # Conditions
-    conditions = medical_snapshot.get('autoanosis_conditions')
-    if conditions and isinstance(conditions, list) and len(conditions) > 0:
-        cond_names = [c.get('name', '') for c in conditions if isinstance(c, dict) and c.get('name')]
-        if cond_names:
-            context_parts.append(f"Παθήσεις: {', '.join(cond_names)}")
-    
-    # Allergies
-    allergies = medical_snapshot.get('autoanosis_allergies')
-    if allergies and isinstance(allergies, list) and len(allergies) > 0:
-        allergy_names = [a.get('name', '') for a in allergies if isinstance(a, dict) and a.get('name')]
-        if allergy_names:
-            context_parts.append(f"Αλλεργίες: {', '.join(allergy_names)}")
-    
-    # Medical Memory (recent notes)
-    memory = medical_snapshot.get('autoanosis_medical_memory')
-    if memory and isinstance(memory, list) and len(memory) > 0:
-        recent = memory[:3]  # Last 3 entries
-        notes = [m.get('note', '') for m in recent if isinstance(m, dict) and m.get('note')]
-        if notes:
-            context_parts.append(f"Πρόσφατες σημειώσεις: {'; '.join(notes)}")
+    for field, key, label, separator, limit in MEDICAL_CONTEXT_FIELDS:
+        items = medical_snapshot.get(field)
+        if not items or not isinstance(items, list):
+            continue
+        values = separator.join(
+            item[key] for item in islice(items, limit)
+            if isinstance(item, dict) and item.get(key)
+        )
+        if values:
+            context_parts.append(f"{label}: {values}")
     
     if not context_parts:
         return ""
     
-    return "\n\n📋 ΠΡΟΣΩΠΙΚΑ ΙΑΤΡΙΚΑ ΔΕΔΟΜΕΝΑ ΧΡΗΣΤΗ:\n" + "\n".join(context_parts) + "\n\nΧρησιμοποίησε αυτά τα στοιχεία για να δώσεις προσωποποιημένες απαντήσεις."
+    return "".join((MEDICAL_CONTEXT_HEADER, "\n".join(context_parts), MEDICAL_CONTEXT_FOOTER))
+
+def authenticate(identity_token):
+    """Resolve the user_id for an identity token, or an error response"""
+    if not identity_token:
+        logger.warning("No identity token provided")
+        return None, json_response({"error": "Identity token required"}, 401)
+
+    is_valid, payload, error = verify_identity_token(identity_token)
+    if not is_valid or not payload:
+        logger.warning("Identity token verification failed: %s", error)
+        return None, json_response({"error": "Invalid identity token"}, 401)
+
+    user_id = payload.get("uid")
+    logger.info("User authenticated via identity token: %s", user_id)
+    return user_id, None
+
+@app.errorhandler(413)
+async def request_too_large(e):
+    return json_response({"error": "Request too large"}, 413)
+
+# Health payload never changes, so it is serialized once at import. A fresh
+# Response is still built per probe because after_request adds CORS headers.
+HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "service": "autoanosis-ai-backend",
+    "version": "3.0.0",
+    "features": ["medical_snapshot", "session_memory", "rate_limiting", "response_cache"]
+})
 
 @app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({
-        "status": "healthy",
-        "service": "autoanosis-ai-backend",
-        "version": "3.0.0",
-        "features": ["medical_snapshot", "session_memory", "rate_limiting"]
-    }), 200
+async def health_check():
+    return Response(HEALTH_BODY, status=200, mimetype="application/json")
+
+@app.route('/cache/stats', methods=['GET'])
+async def cache_stats():
+    return json_response({
+        "exact": response_cache.stats(),
+        "semantic": semantic_cache.stats()
+    })
 
 @app.route('/chat', methods=['POST'])
-def chat():
-    # Cleanup old conversations periodically
-    if len(conversation_storage) > 100:
-        cleanup_old_conversations()
+async def chat():
+    # Read the clock once and reuse it for the whole request
+    now = time.time()
+
+    # Cleanup idle rate-limit buckets periodically
+    if (len(rate_limit_storage) > RATE_LIMIT_SWEEP_THRESHOLD
+            and now - last_rate_limit_sweep > RATE_LIMIT_SWEEP_INTERVAL):
+        cleanup_rate_limits(now)
     
-    data = request.json
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return json_response({"error": "Invalid JSON body"}, 400)
+
     user_message = data.get("message")
-    if not user_message:
-        return jsonify({"error": "No message provided"}), 400
+    if not user_message or not isinstance(user_message, str):
+        return json_response({"error": "No message provided"}, 400)
+    if len(user_message) > MAX_MESSAGE_LENGTH:
+        return json_response({"error": "Message too long"}, 413)
 
     # Get user_id from identity_token (Token Bridge)
-    user_id = None
-    identity_token = data.get("identity_token")
-    
-    if identity_token:
-        is_valid, payload, error = verify_identity_token(identity_token)
-        if is_valid and payload:
-            user_id = payload.get("uid")
-            logger.info(f"User authenticated via identity token: {user_id}")
-        else:
-            logger.warning(f"Identity token verification failed: {error}")
-            return jsonify({"error": "Invalid identity token"}), 401
-    else:
-        logger.warning("No identity token provided")
-        return jsonify({"error": "Identity token required"}), 401
+    user_id, error_response = authenticate(data.get("identity_token"))
+    if error_response is not None:
+        return error_response
     
     # Rate limiting (per user)
     rate_limit_key = f"user_{user_id}"
-    if not check_rate_limit(rate_limit_key):
-        return jsonify({"error": "Rate limit exceeded. Please try again later."}), 429
+    if not await check_rate_limit(rate_limit_key, now):
+        return json_response({"error": "Rate limit exceeded. Please try again later."}, 429)
 
     # Get conversation ID
     conversation_id = data.get("conversation_id")
     if not conversation_id:
-        conversation_id = f"conv_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-        logger.info(f"Generated new conversation ID: {conversation_id}")
+        import uuid
+        conversation_id = f"conv_{int(now)}_{uuid.uuid4().hex[:8]}"
+        logger.info("Generated new conversation ID: %s", conversation_id)
 
-    # Build system prompt
-    system_prompt = SYSTEM_PROMPT_BASE
-    
-    # Add medical context if available
+    # Build medical context if available (sent as its own message so the
+    # static system prompt prefix stays identical for prompt caching)
+    medical_context = ""
     medical_snapshot = data.get("medical_snapshot")
     if medical_snapshot:
         medical_context = build_medical_context(medical_snapshot)
         if medical_context:
-            system_prompt += medical_context
-            logger.info(f"Medical context injected for user {user_id}")
+            logger.info("Medical context injected for user %s", user_id)
         else:
-            logger.info(f"Medical snapshot provided but empty for user {user_id}")
+            logger.info("Medical snapshot provided but empty for user %s", user_id)
     else:
-        logger.info(f"No medical snapshot provided for user {user_id}")
+        logger.info("No medical snapshot provided for user %s", user_id)
 
     # Get conversation history
-    history = get_conversation_history(conversation_id)
+    history = await get_conversation_history(conversation_id, user_id)
     
-    # Build messages for OpenAI
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    # Add conversation history (last N messages)
     if history:
-        messages.extend(history)
-        logger.info(f"Added {len(history)} messages from conversation history")
-    
-    # Add current user message
-    messages.append({"role": "user", "content": user_message})
+        logger.info("Added %s messages from conversation history", len(history))
 
-    try:
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.7
+    # Build messages for OpenAI in one pass: static prompt, per-user
+    # context, stored history (not copied beforehand), current message
+    messages = [
+        SYSTEM_MESSAGE,
+        *([{"role": "system", "content": medical_context}] if medical_context else ()),
+        *history,
+        {"role": "user", "content": user_message},
+    ]
+
+    # Only first-turn questions are cacheable; follow-ups depend on history
+    cache_key = None
+    query_embedding = None
+    ai_response = None
+    if not history:
+        cache_key = make_cache_key(CHAT_MODEL, SYSTEM_PROMPT_BASE, medical_context,
+                                   user_message, CHAT_TEMPERATURE)
+        ai_response = await response_cache.get(cache_key)
+        if ai_response is not None:
+            logger.info("Response cache hit for user %s", user_id)
+        elif SEMANTIC_CACHE_ENABLED and not medical_context:
+            # Requests with a medical snapshot never match paraphrases; the
+            # message itself is not screened (see SEMANTIC_CACHE_ENABLED)
+            query_embedding = await embed_message(user_message)
+            if query_embedding is not None:
+                ai_response = semantic_cache.lookup(query_embedding)
+                if ai_response is not None:
+                    logger.info("Semantic cache hit for user %s", user_id)
+                    await response_cache.set(cache_key, ai_response)
+
+    # Stream tokens via SSE when the client asks for it
+    wants_stream = data.get("stream") is True or "text/event-stream" in request.headers.get("Accept", "")
+    if wants_stream:
+        response = Response(
+            stream_chat(messages, ai_response, cache_key, query_embedding,
+                        conversation_id, user_id, user_message),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
         )
-        ai_response = response.choices[0].message.content
+        response.timeout = None
+        return response
+
+    try:
+        if ai_response is None:
+            ai_response = await complete_chat(messages, cache_key, query_embedding, user_id)
         
         # Save to conversation history
-        save_conversation_message(conversation_id, user_id, "user", user_message)
-        save_conversation_message(conversation_id, user_id, "assistant", ai_response)
+        await save_conversation_turn(conversation_id, user_id, user_message, ai_response, now)
         
-        logger.info(f"Chat interaction: User={user_id}, Conversation={conversation_id}")
+        logger.info("Chat interaction: User=%s, Conversation=%s", user_id, conversation_id)
         
-        return jsonify({
+        return json_response({
             "reply": ai_response,
             "conversation_id": conversation_id
         })
     except Exception as e:
-        logger.error(f"OpenAI Error: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("OpenAI Error: %s", e)
+        return json_response({"error": str(e)}, 500)
+
+@app.route('/chat/batch', methods=['POST'])
+async def submit_chat_batch():
+    """Queue non-interactive questions on the OpenAI Batch API"""
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return json_response({"error": "Invalid JSON body"}, 400)
+
+    prompts = data.get("prompts")
+    if (not isinstance(prompts, list) or not prompts
+            or not all(isinstance(p, str) and p for p in prompts)):
+        return json_response({"error": "No prompts provided"}, 400)
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return json_response({"error": f"At most {BATCH_MAX_PROMPTS} prompts per batch"}, 413)
+    if any(len(p) > MAX_MESSAGE_LENGTH for p in prompts):
+        return json_response({"error": "Message too long"}, 413)
+
+    user_id, error_response = authenticate(data.get("identity_token"))
+    if error_response is not None:
+        return error_response
+    if not await check_rate_limit(f"user_{user_id}", cost=len(prompts)):
+        return json_response({"error": "Rate limit exceeded. Please try again later."}, 429)
+
+    # One JSONL line per prompt, each a standalone first-turn chat completion
+    batch_input = b"\n".join(
+        orjson.dumps({
+            "custom_id": f"prompt-{index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": CHAT_MODEL,
+                "messages": [SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
+                "temperature": CHAT_TEMPERATURE
+            }
+        })
+        for index, prompt in enumerate(prompts)
+    )
+
+    try:
+        client = get_openai_client()
+        async with openai_slots:
+            input_file = await client.files.create(
+                file=(f"chat_batch_{user_id}.jsonl", batch_input),
+                purpose="batch"
+            )
+            batch = await client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window=BATCH_COMPLETION_WINDOW,
+                metadata={"user_id": str(user_id), "prompts": str(len(prompts))}
+            )
+    except Exception as e:
+        logger.error("OpenAI Batch Error: %s", e)
+        return json_response({"error": str(e)}, 500)
+
+    logger.info("Chat batch submitted: User=%s, Batch=%s, Prompts=%s", user_id, batch.id, len(prompts))
+
+    return json_response({"batch_id": batch.id, "status": batch.status}, 202)
+
+async def collect_batch_results(client, batch) -> list:
+    """Read a finished batch's output and error files into per-prompt results"""
+    replies = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.content.splitlines():
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            index = int(item["custom_id"].rsplit("-", 1)[1])
+            body = (item.get("response") or {}).get("body") or {}
+            choices = body.get("choices") or []
+            if choices:
+                replies[index] = {"index": index, "reply": choices[0]["message"]["content"]}
+            else:
+                error = item.get("error") or body.get("error") or {}
+                replies[index] = {"index": index, "error": error.get("message", "Request failed")}
+
+    # Every submitted prompt gets an entry, including ones OpenAI never
+    # answered (e.g. the whole batch failed validation or expired)
+    prompt_count = int((batch.metadata or {}).get("prompts") or 0)
+    if replies:
+        prompt_count = max(prompt_count, max(replies) + 1)
+    missing = {"error": f"Batch {batch.status} without a reply"}
+    return [replies.get(index) or {"index": index, **missing} for index in range(prompt_count)]
+
+async def delete_batch_files(client, batch):
+    """Remove a finished batch's files so they do not pile up in the org's storage"""
+    for file_id in (batch.input_file_id, batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        try:
+            await client.files.delete(file_id)
+        except Exception as e:
+            logger.warning("Batch file cleanup failed for %s: %s", file_id, e)
+
+@app.route('/chat/batch/<batch_id>', methods=['POST'])
+async def get_chat_batch(batch_id: str):
+    """Report a batch's status and, once finished, its replies"""
+    data = await request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return json_response({"error": "Invalid JSON body"}, 400)
+
+    user_id, error_response = authenticate(data.get("identity_token"))
+    if error_response is not None:
+        return error_response
+    client = get_openai_client()
+    from openai import NotFoundError
+    try:
+        async with openai_slots:
+            batch = await client.batches.retrieve(batch_id)
+    except NotFoundError:
+        batch = None
+    except Exception as e:
+        logger.error("OpenAI Batch Error: %s", e)
+        return json_response({"error": str(e)}, 500)
+
+    if batch is None or (batch.metadata or {}).get("user_id") != str(user_id):
+        return json_response({"error": "Batch not found"}, 404)
+    if batch.status not in BATCH_FINAL_STATUSES:
+        return json_response({"batch_id": batch.id, "status": batch.status})
+
+    # Results are read once, then the batch's files are deleted and the
+    # results served from batch_results_cache
+    cached = await batch_results_cache.get(batch.id)
+    if cached is not None:
+        results = orjson.loads(cached)
+    else:
+        try:
+            async with openai_slots:
+                results = await collect_batch_results(client, batch)
+                await batch_results_cache.set(batch.id, orjson.dumps(results).decode())
+                await delete_batch_files(client, batch)
+        except NotFoundError:
+            # A concurrent poll may have just stored the results and deleted
+            # the files; only if they are not cached either are they gone
+            cached = await batch_results_cache.get(batch.id)
+            if cached is None:
+                return json_response({"error": "Batch results are no longer available"}, 410)
+            results = orjson.loads(cached)
+        except Exception as e:
+            logger.error("OpenAI Batch Error: %s", e)
+            return json_response({"error": str(e)}, 500)
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=10000)
+    return json_response({"batch_id": batch.id, "status": batch.status, "results": results})
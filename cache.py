@@ -0,0 +1,282 @@
+"""
+Autoanosis Response Cache
+Exact-match and semantic (embedding similarity) caches for repeated
+chat questions (e.g. common health FAQs)
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import orjson
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message: str) -> str:
+    """
+    Normalize a user message for cache lookups
+
+    Collapses whitespace and case so trivially different spellings of the
+    same question share one cache entry.
+
+    Args:
+        message: Raw user message
+
+    Returns:
+        Normalized message
+    """
+    return " ".join(message.split()).casefold()
+
+
+def make_cache_key(model: str, system: str, context: str, user: str, temperature: float) -> str:
+    """
+    Build the exact-match cache key for a chat completion
+
+    Args:
+        model: OpenAI model name
+        system: Static system prompt sent to the model
+        context: Per-user medical context message ("" if none)
+        user: User message (normalized before hashing)
+        temperature: Sampling temperature
+
+    Returns:
+        Hex SHA-256 digest of the canonical request
+    """
+    raw = orjson.dumps(
+        {
+            "model": model,
+            "system": system,
+            "context": context,
+            "user": normalize_message(user),
+            "temperature": temperature,
+        },
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.sha256(raw).hexdigest()
+
+
+class ResponseCache:
+    """
+    TTL cache of AI responses with hit/miss counters
+
+    Entries always live in an in-process TTLCache. When a Redis client is
+    given it backs that local tier, so every worker (and every restart)
+    sees responses cached by the others. Local access never awaits, so it
+    needs no locking on the worker's event loop.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 3600, redis=None, prefix: bytes = b"chat:"):
+        self._store: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._redis = redis
+        self._prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on miss"""
+        entry = self._store.get(key)
+        if entry is None and self._redis is not None:
+            try:
+                raw = await self._redis.get(self._prefix + key.encode("ascii"))
+            except Exception as e:
+                logger.warning("Redis cache read failed: %s", e)
+                raw = None
+            if raw is not None:
+                entry = orjson.loads(raw)
+                self._store[key] = entry
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["response"]
+
+    async def set(self, key: str, response: str) -> None:
+        """Store a response under key"""
+        entry = {"response": response}
+        self._store[key] = entry
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._prefix + key.encode("ascii"), orjson.dumps(entry),
+                                      ex=int(self._store.ttl))
+            except Exception as e:
+                logger.warning("Redis cache write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters for monitoring"""
+        return {
+            "backend": "redis" if self._redis is not None else "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._store),
+            "maxsize": self._store.maxsize,
+            "ttl": self._store.ttl,
+        }
+
+
+class SemanticCache:
+    """
+    Embedding-similarity cache for paraphrased questions
+
+    Normalized embeddings live in a preallocated float32 matrix used as a
+    ring buffer, so a lookup is one matrix-vector product and an insert
+    overwrites the oldest row without copying the matrix.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        maxsize: int = 5_000,
+        path: Optional[str] = None,
+        persist_every: int = 50,
+        fingerprint: str = ""
+    ):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.path = path
+        self.persist_every = persist_every
+        self.fingerprint = fingerprint
+        self._matrix: Optional[np.ndarray] = None
+        self._responses: List[Optional[str]] = [None] * maxsize
+        self._count = 0
+        self._next = 0
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            try:
+                self.load()
+            except Exception as e:
+                # A truncated or foreign file must not keep the service from booting
+                logger.warning("Semantic cache load failed, starting empty: %s", e)
+                self._reset()
+
+    def _reset(self) -> None:
+        self._matrix = None
+        self._responses = [None] * self.maxsize
+        self._count = 0
+        self._next = 0
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+
+    def lookup(self, embedding: Sequence[float]) -> Optional[str]:
+        """
+        Find the cached response closest to embedding
+
+        Args:
+            embedding: Embedding of the incoming user message
+
+        Returns:
+            Cached response if cosine similarity exceeds the threshold,
+            None otherwise
+        """
+        query = self._normalize(embedding)
+        if query is None or self._count == 0 or query.shape[0] != self._matrix.shape[1]:
+            self.misses += 1
+            return None
+
+        similarities = self._matrix[:self._count] @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._responses[best]
+
+    def add(self, embedding: Sequence[float], response: str) -> None:
+        """Store response under embedding, evicting the oldest entry when full"""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        if self._matrix is None:
+            self._matrix = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self._matrix.shape[1]:
+            return
+
+        slot = self._next % self.maxsize
+        self._matrix[slot] = vector
+        self._responses[slot] = response
+        self._next = slot + 1
+        self._count = min(self._count + 1, self.maxsize)
+        self._unsaved += 1
+
+    @property
+    def should_persist(self) -> bool:
+        """True when enough new entries have accumulated to write to disk"""
+        return bool(self.path) and self._unsaved >= self.persist_every
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy the cache state so it can be written outside the event loop"""
+        self._unsaved = 0
+        return {
+            "matrix": None if self._matrix is None else self._matrix[:self._count].copy(),
+            "responses": self._responses[:self._count],
+            "next": self._next,
+            "fingerprint": self.fingerprint,
+        }
+
+    def save(self, snapshot: Dict[str, Any]) -> None:
+        """
+        Atomically pickle a snapshot to the configured path
+
+        Every worker process writes its own temp file, so concurrent saves
+        never share an inode. Each worker holds its own entries, though, and
+        the rename is last-writer-wins: whichever worker saves last replaces
+        the entries the others persisted.
+        """
+        if not self.path:
+            return
+        f = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(self.path)),
+            prefix=f"{os.path.basename(self.path)}.",
+            suffix=".tmp",
+            delete=False
+        )
+        try:
+            with f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, self.path)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+
+    def load(self) -> None:
+        """Restore entries previously written by save()"""
+        with open(self.path, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot.get("fingerprint", "") != self.fingerprint:
+            logger.warning("Semantic cache at %s was built with different settings, discarding it",
+                           self.path)
+            return
+        matrix = snapshot.get("matrix")
+        if matrix is None or len(matrix) == 0:
+            return
+
+        count = min(len(matrix), self.maxsize)
+        self._matrix = np.zeros((self.maxsize, matrix.shape[1]), dtype=np.float32)
+        self._matrix[:count] = matrix[:count]
+        self._responses[:count] = snapshot["responses"][:count]
+        self._count = count
+        self._next = snapshot.get("next", count) % self.maxsize
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters for monitoring"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self._count,
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+        }
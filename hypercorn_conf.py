@@ -0,0 +1,18 @@
+"""
+Autoanosis AI Backend - Hypercorn configuration
+Loaded by Render's start command: hypercorn -c file:hypercorn_conf.py app:app
+"""
+
+import os
+
+# Render injects PORT; 10000 is Render's default
+bind = [f"0.0.0.0:{os.environ.get('PORT', '10000')}"]
+
+# uvloop event loop per worker; each worker multiplexes many in-flight /chat calls
+worker_class = "uvloop"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# Keep idle client connections open longer than Render's proxy idle timeout
+# so sockets are reused instead of re-handshaken
+keep_alive_timeout = 75
+graceful_timeout = 30
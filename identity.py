@@ -5,31 +5,43 @@ Verifies HMAC-SHA256 signed identity tokens from WordPress
 
 import base64
 import hmac
-import hashlib
-import json
 import os
 import time
 from typing import Tuple, Dict, Any, Optional
 
+import orjson
 
-def _b64url_decode(s: str) -> bytes:
+
+# Shared secret, read and encoded once at import; a missing secret is a
+# deployment error, so fail at boot rather than rejecting every request
+_SECRET = os.environ.get("AUTOANOSIS_IDENTITY_SECRET", "")
+if not _SECRET:
+    raise RuntimeError("AUTOANOSIS_IDENTITY_SECRET environment variable is not set")
+_SECRET_BYTES = _SECRET.encode("utf-8")
+del _SECRET
+
+# Maximum allowed clock skew between WordPress and this server
+MAX_CLOCK_SKEW_SECONDS = 60
+
+
+def _b64url_decode(s: bytes) -> bytes:
     """
-    Decode base64url encoded string
+    Decode base64url encoded bytes
     
     Args:
-        s: Base64URL encoded string
+        s: Base64URL encoded bytes
         
     Returns:
         Decoded bytes
     """
     # Add padding if needed
-    s += "=" * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s.encode("utf-8"))
+    s += b"=" * (-len(s) % 4)
+    return base64.urlsafe_b64decode(s)
 
 
 def verify_identity_token(
     token: str, 
-    max_clock_skew_seconds: int = 60
+    max_clock_skew_seconds: int = MAX_CLOCK_SKEW_SECONDS
 ) -> Tuple[bool, Optional[Dict[str, Any]], Optional[str]]:
     """
     Verify WordPress identity token
@@ -48,26 +60,15 @@ def verify_identity_token(
         - payload_dict: Decoded payload if valid, None otherwise
         - error_code: Error code string if invalid, None otherwise
     """
-    # Get shared secret from environment
-    secret = os.environ.get("AUTOANOSIS_IDENTITY_SECRET", "")
-    if not secret:
-        return False, None, "missing_server_secret"
-
     # Check token format
-    if not token or "." not in token:
+    if not token or not isinstance(token, str) or "." not in token:
         return False, None, "bad_format"
 
-    try:
-        payload_b64, sig_b64 = token.split(".", 1)
-    except ValueError:
-        return False, None, "bad_format"
+    # Encode once and work on bytes from here on
+    payload_b64, sig_b64 = token.encode("utf-8").split(b".", 1)
 
-    # Compute expected signature
-    expected_sig = hmac.new(
-        secret.encode("utf-8"),
-        payload_b64.encode("utf-8"),
-        hashlib.sha256
-    ).digest()
+    # Compute expected signature (one-shot C implementation)
+    expected_sig = hmac.digest(_SECRET_BYTES, payload_b64, "sha256")
 
     # Decode provided signature
     try:
@@ -79,10 +80,9 @@ def verify_identity_token(
     if not hmac.compare_digest(expected_sig, provided_sig):
         return False, None, "signature_mismatch"
 
-    # Decode and parse payload
+    # Decode and parse payload (orjson parses and UTF-8 validates bytes directly)
     try:
-        payload_json = _b64url_decode(payload_b64).decode("utf-8")
-        payload = json.loads(payload_json)
+        payload = orjson.loads(_b64url_decode(payload_b64))
     except Exception:
         return False, None, "bad_payload"
 